@@ -1,12 +1,15 @@
 import argparse
-import base64
+import binascii
 import hashlib
+import hmac
 import io
 import json
+import logging
 import os
 import secrets
 import uuid
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from functools import wraps
 from typing import Dict, Any, List, Tuple
 
@@ -14,10 +17,23 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from PIL import Image, ImageOps
 import numpy as np
-import imagehash
-from sklearn.cluster import KMeans
 import cv2
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'frontend'))
@@ -26,18 +42,34 @@ IMAGES_DIR = os.path.join(BASE_DIR, 'images')
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
 ARTWORKS_JSON = os.path.join(BASE_DIR, 'artworks.json')
 EMBEDDINGS_JSON = os.path.join(BASE_DIR, 'embeddings.json')
-ANALYTICS_LOG = os.path.join(BASE_DIR, 'analytics_log.json')
+EMBEDDINGS_NPZ = os.path.join(BASE_DIR, 'embeddings.npz')
+ANALYTICS_LOG = os.path.join(BASE_DIR, 'analytics_log.jsonl')
+LEGACY_ANALYTICS_LOG = os.path.join(BASE_DIR, 'analytics_log.json')
 
 
 app = Flask(__name__)
 CORS(app)
 
+logger = logging.getLogger(__name__)
+
+
+def _json_loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
 
 def load_artworks() -> Dict[str, Any]:
     if not os.path.exists(ARTWORKS_JSON):
         return {}
-    with open(ARTWORKS_JSON, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(ARTWORKS_JSON, 'rb') as f:
+        return _json_loads(f.read())
 
 
 ARTWORKS = load_artworks()
@@ -46,26 +78,39 @@ ARTWORKS = load_artworks()
 def safe_write_json(path: str, data: Any) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
     tmp_path = f"{path}.tmp"
-    with open(tmp_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    with open(tmp_path, 'wb') as f:
+        f.write(_json_dumps(data))
     os.replace(tmp_path, path)
 
 
-def preprocess_image_for_matching(pil_img: Image.Image, max_size: int = 512) -> Image.Image:
+def preprocess_image_for_matching(pil_img, max_size: int = 512):
     """
     Preprocess image to normalize for better matching:
     - Auto-orient based on EXIF
     - Resize to consistent max dimension
     - Convert to RGB
+
+    Accepts a PIL image or an RGB uint8 ndarray (for arrays, orientation
+    is assumed to be already applied by the decoder).
     """
+    if isinstance(pil_img, np.ndarray):
+        h, w = pil_img.shape[:2]
+        max_dim = max(h, w)
+        if max_dim > max_size:
+            scale = max_size / float(max_dim)
+            pil_img = cv2.resize(pil_img, (int(w * scale), int(h * scale)),
+                                 interpolation=cv2.INTER_AREA)
+        return pil_img
+
     try:
         # Auto-orient based on EXIF data
         pil_img = ImageOps.exif_transpose(pil_img)
     except Exception:
         pass
     
-    # Ensure RGB
-    pil_img = pil_img.convert('RGB')
+    # Ensure RGB (convert allocates a full copy, so skip when already RGB)
+    if pil_img.mode != 'RGB':
+        pil_img = pil_img.convert('RGB')
     
     # Resize to max_size while maintaining aspect ratio
     w, h = pil_img.size
@@ -79,19 +124,58 @@ def preprocess_image_for_matching(pil_img: Image.Image, max_size: int = 512) ->
     return pil_img
 
 
-def compute_phash_from_image(pil_img: Image.Image) -> int:
-    # Preprocess before hashing for better matching
-    pil_img = preprocess_image_for_matching(pil_img)
-    return int(str(imagehash.phash(pil_img)), 16)
+def _pack_phash(block: np.ndarray) -> np.uint64:
+    # Median-threshold the 8x8 DCT block and pack the bits into a uint64
+    flat = block.ravel()
+    med = np.median(flat)
+    h = np.uint64(0)
+    one = np.uint64(1)
+    for i in range(64):
+        h = h << one
+        if flat[i] > med:
+            h = h | one
+    return h
+
+
+if njit is not None:
+    _pack_phash = njit(cache=True)(_pack_phash)
+    # Warm the JIT at import so the first request does not pay compile time
+    _pack_phash(np.zeros((8, 8), dtype=np.float32))
+
+
+def compute_phash_from_image(img) -> int:
+    """
+    Compute a 64-bit perceptual hash (pHash) via OpenCV:
+    grayscale -> 32x32 INTER_AREA resize -> DCT -> top-left 8x8 ->
+    median threshold -> bits packed into a Python int.
+
+    Accepts either a PIL image (preprocessed first) or an already-decoded
+    uint8 ndarray (HxWx3 RGB or HxW grayscale).
+    """
+    if isinstance(img, Image.Image):
+        # Preprocess before hashing for better matching
+        img = np.asarray(preprocess_image_for_matching(img))
+    if img.ndim == 3:
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(small.astype(np.float32))
+    return int(_pack_phash(np.ascontiguousarray(dct[:8, :8])))
 
 
 def hamming_distance_int(a: int, b: int) -> int:
     return (a ^ b).bit_count()
 
 
-def kmeans_palette(pil_img: Image.Image, k: int = 5) -> List[Dict[str, Any]]:
-    img = pil_img.convert('RGB').resize((200, 200))
-    arr = np.asarray(img).reshape(-1, 3).astype(np.float32)
+def kmeans_palette(img, k: int = 5) -> List[Dict[str, Any]]:
+    # Accepts either a PIL image or an RGB uint8 ndarray (HxWx3)
+    if isinstance(img, Image.Image):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = np.asarray(img)
+    img = cv2.resize(img, (200, 200), interpolation=cv2.INTER_AREA)
+    arr = img.reshape(-1, 3).astype(np.float32)
     # Subsample for speed if huge
     if arr.shape[0] > 50000:
         idx = np.random.choice(arr.shape[0], 50000, replace=False)
@@ -99,12 +183,15 @@ def kmeans_palette(pil_img: Image.Image, k: int = 5) -> List[Dict[str, Any]]:
     else:
         arr_sample = arr
 
-    km = KMeans(n_clusters=k, n_init=5, random_state=42)
-    labels = km.fit_predict(arr_sample)
-    centers = km.cluster_centers_.astype(np.int32)
+    # cv2.kmeans is a tight C++ implementation; with k-means++ init a
+    # single run is enough (no need for sklearn's n_init restarts)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    _, labels, centers = cv2.kmeans(arr_sample, k, None, criteria, 1,
+                                    cv2.KMEANS_PP_CENTERS)
+    centers = centers.astype(np.int32)
 
     # Compute percentages on the sampled set
-    counts = np.bincount(labels, minlength=k)
+    counts = np.bincount(labels.flatten(), minlength=k)
     total = int(counts.sum()) if counts.sum() > 0 else 1
 
     def rgb_to_hex(rgb: Tuple[int, int, int]) -> str:
@@ -124,22 +211,83 @@ def kmeans_palette(pil_img: Image.Image, k: int = 5) -> List[Dict[str, Any]]:
     return palette
 
 
-def texture_edge_density(pil_img: Image.Image) -> float:
-    img_rgb = pil_img.convert('RGB')
-    img_np = np.array(img_rgb)
-    gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+def texture_edge_density(img) -> float:
+    # Accepts a PIL image, an RGB uint8 ndarray, or an already-gray ndarray
+    if isinstance(img, Image.Image):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = np.asarray(img)
+    if img.ndim == 3:
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img
+    # Edge density is scale-invariant; downsample so Canny cost does not
+    # grow with upload resolution (mirrors the 200x200 palette resize)
+    if gray.shape[0] > 256 or gray.shape[1] > 256:
+        gray = cv2.resize(gray, (256, 256), interpolation=cv2.INTER_AREA)
     edges = cv2.Canny(gray, threshold1=100, threshold2=200)
     edge_pixels = int(np.count_nonzero(edges))
     total_pixels = edges.size if edges.size > 0 else 1
     return edge_pixels / total_pixels
 
 
-def decode_upload_to_image(req) -> Tuple[Image.Image, str]:
-    # Returns (PIL.Image, error_message or '')
+_EXIF_ORIENTATION_TAG = 274
+
+
+def _jpeg_orientation(binary: bytes) -> int:
+    # PIL only parses headers here, no pixel decode
+    try:
+        with Image.open(io.BytesIO(binary)) as im:
+            return int(im.getexif().get(_EXIF_ORIENTATION_TAG, 1))
+    except Exception:
+        return 1
+
+
+def _apply_exif_orientation(arr: np.ndarray, orientation: int) -> np.ndarray:
+    # Mirrors ImageOps.exif_transpose for decoded ndarrays
+    if orientation == 2:
+        arr = arr[:, ::-1]
+    elif orientation == 3:
+        arr = np.rot90(arr, 2)
+    elif orientation == 4:
+        arr = arr[::-1]
+    elif orientation == 5:
+        arr = arr.transpose(1, 0, 2)
+    elif orientation == 6:
+        arr = np.rot90(arr, 3)
+    elif orientation == 7:
+        arr = np.rot90(arr.transpose(1, 0, 2), 2)
+    elif orientation == 8:
+        arr = np.rot90(arr, 1)
+    return np.ascontiguousarray(arr)
+
+
+def _decode_image_bytes(binary: bytes):
+    # JPEG fast path: libjpeg-turbo straight to an RGB ndarray; everything
+    # else (PNG, etc.) falls back to PIL
+    if simplejpeg is not None and binary[:3] == b'\xff\xd8\xff':
+        try:
+            arr = simplejpeg.decode_jpeg(binary, colorspace='RGB')
+            orientation = _jpeg_orientation(binary)
+            if orientation != 1:
+                arr = _apply_exif_orientation(arr, orientation)
+            return arr
+        except Exception:
+            pass
+    # Mode normalization happens in preprocess_image_for_matching
+    img = Image.open(io.BytesIO(binary))
+    # Force the pixel decode so truncated/corrupt payloads fail here,
+    # inside the caller's try/except, not later in the feature pipeline
+    img.load()
+    return img
+
+
+def decode_upload_to_image(req):
+    # Returns (PIL.Image or RGB ndarray, error_message or '')
     if req.files and 'file' in req.files:
         f = req.files['file']
         try:
-            img = Image.open(f.stream).convert('RGB')
+            img = _decode_image_bytes(f.stream.read())
             return img, ''
         except Exception as e:
             return None, f"Invalid image upload: {e}"
@@ -149,39 +297,138 @@ def decode_upload_to_image(req) -> Tuple[Image.Image, str]:
             b64data = data.get('image_base64')
             if not b64data:
                 return None, 'No image provided. Expect multipart file "file" or JSON {"image_base64": dataURL}'
-            if ',' in b64data:
-                b64data = b64data.split(',', 1)[1]
-            binary = base64.b64decode(b64data)
-            img = Image.open(io.BytesIO(binary)).convert('RGB')
+            # Strip the data-URL prefix via a memoryview slice so decoding
+            # does not copy the multi-MB payload an extra time
+            buf = b64data.encode('ascii')
+            comma = buf.find(b',')
+            binary = binascii.a2b_base64(memoryview(buf)[comma + 1:])
+            img = _decode_image_bytes(binary)
             return img, ''
         except Exception as e:
             return None, f"Invalid base64 image: {e}"
 
 
+def _append_analytics_events(events: List[Dict[str, Any]]) -> None:
+    # Append-only JSONL: O(1) per event instead of rewriting the whole log
+    with open(ANALYTICS_LOG, 'ab') as f:
+        for e in events:
+            if orjson is not None:
+                f.write(orjson.dumps(e) + b'\n')
+            else:
+                f.write(json.dumps(e, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
 def ensure_analytics_log():
-    if not os.path.exists(ANALYTICS_LOG):
-        safe_write_json(ANALYTICS_LOG, [])
+    # One-time migration from the old JSON-array log to append-only JSONL
+    if os.path.exists(ANALYTICS_LOG) or not os.path.exists(LEGACY_ANALYTICS_LOG):
+        return
+    try:
+        with open(LEGACY_ANALYTICS_LOG, 'rb') as f:
+            arr = _json_loads(f.read())
+    except Exception:
+        arr = []
+    if isinstance(arr, list) and arr:
+        _append_analytics_events(arr)
+    os.replace(LEGACY_ANALYTICS_LOG, f"{LEGACY_ANALYTICS_LOG}.bak")
+
+
+# Cached embeddings, refreshed only when the store changes on disk,
+# so /analyze does not re-read and re-parse the file on every request.
+_EMB_CACHE: Dict[str, Any] = {"path": None, "mtime": None, "data": {}}
 
 
 def load_embeddings() -> Dict[str, int]:
-    if not os.path.exists(EMBEDDINGS_JSON):
+    # Binary .npz is the primary store; JSON is kept for legacy catalogs
+    # and external tooling
+    path = EMBEDDINGS_NPZ if os.path.exists(EMBEDDINGS_NPZ) else EMBEDDINGS_JSON
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        _EMB_CACHE.update(path=None, mtime=None, data={})
+        _invalidate_phash_index()
         return {}
-    with open(EMBEDDINGS_JSON, 'r', encoding='utf-8') as f:
-        raw = json.load(f)
-    # Convert str->int
+    if path == _EMB_CACHE["path"] and mtime == _EMB_CACHE["mtime"]:
+        return _EMB_CACHE["data"]
     res = {}
-    for k, v in raw.items():
-        try:
-            res[k] = int(v)
-        except Exception:
-            continue
+    if path == EMBEDDINGS_NPZ:
+        with np.load(path, allow_pickle=False) as npz:
+            for k, v in zip(npz['ids'], npz['hashes']):
+                res[str(k)] = int(v)
+    else:
+        with open(path, 'rb') as f:
+            raw = _json_loads(f.read())
+        # Convert str->int
+        for k, v in raw.items():
+            try:
+                res[k] = int(v)
+            except Exception:
+                continue
+    _EMB_CACHE.update(path=path, mtime=mtime, data=res)
+    _invalidate_phash_index()
     return res
 
 
 def save_embeddings(mapping: Dict[str, int]):
-    # Store as strified ints
-    out = {k: str(int(v)) for k, v in mapping.items()}
-    safe_write_json(EMBEDDINGS_JSON, out)
+    # Binary store: ids + packed uint64 hashes, written atomically
+    ids = list(mapping.keys())
+    hashes = np.fromiter(mapping.values(), dtype=np.uint64, count=len(mapping))
+    tmp_path = f"{EMBEDDINGS_NPZ}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, ids=np.array(ids), hashes=hashes)
+    os.replace(tmp_path, EMBEDDINGS_NPZ)
+    # JSON export kept as a compatibility shim for external tooling
+    safe_write_json(EMBEDDINGS_JSON, {k: str(int(v)) for k, v in mapping.items()})
+    # Keep the in-memory cache current so readers never hit the disk copy
+    try:
+        mtime = os.path.getmtime(EMBEDDINGS_NPZ)
+    except OSError:
+        mtime = None
+    _EMB_CACHE.update(path=EMBEDDINGS_NPZ, mtime=mtime,
+                      data={k: int(v) for k, v in mapping.items()})
+    _invalidate_phash_index()
+
+
+# Structure-of-arrays view of the embeddings: ids alongside one contiguous
+# np.uint64 vector, so /analyze scans packed hashes in a single vectorized
+# NumPy pass instead of iterating a dict of boxed Python ints. Stored as
+# (source_dict, ids, hashes); the source dict's identity tells us whether
+# _EMB_CACHE was refreshed since the arrays were built.
+_PHASH_INDEX: Tuple[Dict[str, int], List[str], np.ndarray] = None
+
+
+def _invalidate_phash_index():
+    global _PHASH_INDEX
+    _PHASH_INDEX = None
+
+
+def _get_phash_index() -> Tuple[List[str], np.ndarray]:
+    global _PHASH_INDEX
+    # Always consult load_embeddings (a stat per request when warm) so
+    # out-of-band changes to the store are picked up, and rebuild the
+    # arrays whenever the cache handed back a new dict
+    embeddings = load_embeddings()
+    if _PHASH_INDEX is None or _PHASH_INDEX[0] is not embeddings:
+        ids = list(embeddings.keys())
+        hashes = np.fromiter(embeddings.values(), dtype=np.uint64,
+                             count=len(embeddings))
+        _PHASH_INDEX = (embeddings, ids, hashes)
+    return _PHASH_INDEX[1], _PHASH_INDEX[2]
+
+
+# Linear-scan tuning: distances below EARLY_EXIT_DISTANCE in the first
+# SCAN_BLOCK hashes are near-exact matches, so the rest of the catalog
+# need not be scanned
+SCAN_BLOCK = 1024
+EARLY_EXIT_DISTANCE = 4
+
+
+if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+    def _popcount_u64(arr: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(arr)
+else:
+    def _popcount_u64(arr: np.ndarray) -> np.ndarray:
+        bits = np.unpackbits(arr.view(np.uint8))
+        return bits.reshape(arr.shape[0], 64).sum(axis=1)
 
 
 @app.route('/')
@@ -193,19 +440,31 @@ def serve_index():
     return jsonify({"error": "frontend not found"}), 404
 
 
+STATIC_CACHE_MAX_AGE = 86400  # assets are not content-hashed, so 1 day + revalidation
+
+
+def _send_cached(directory: str, filename: str):
+    # conditional=True gives mtime/size-based ETags and If-None-Match 304s.
+    # max_age must go through send_from_directory: werkzeug then emits
+    # "public, max-age=..." and clears the default no-cache, which would
+    # otherwise force revalidation on every use
+    return send_from_directory(directory, filename, conditional=True,
+                               max_age=STATIC_CACHE_MAX_AGE)
+
+
 @app.route('/css/<path:filename>')
 def serve_css(filename):
-    return send_from_directory(os.path.join(FRONTEND_DIR, 'css'), filename)
+    return _send_cached(os.path.join(FRONTEND_DIR, 'css'), filename)
 
 
 @app.route('/js/<path:filename>')
 def serve_js(filename):
-    return send_from_directory(os.path.join(FRONTEND_DIR, 'js'), filename)
+    return _send_cached(os.path.join(FRONTEND_DIR, 'js'), filename)
 
 
 @app.route('/demo_mode_images/<path:filename>')
 def serve_demo_images(filename):
-    return send_from_directory(os.path.join(FRONTEND_DIR, 'demo_mode_images'), filename)
+    return _send_cached(os.path.join(FRONTEND_DIR, 'demo_mode_images'), filename)
 
 
 @app.route('/sw.js')
@@ -222,87 +481,112 @@ def serve_artworks_json():
 
 @app.route('/static/audio/<path:filename>')
 def serve_audio(filename):
-    return send_from_directory(os.path.join(STATIC_DIR, 'audio'), filename)
+    return _send_cached(os.path.join(STATIC_DIR, 'audio'), filename)
 
 
 @app.route('/static/video/<path:filename>')
 def serve_video(filename):
-    return send_from_directory(os.path.join(STATIC_DIR, 'video'), filename)
+    return _send_cached(os.path.join(STATIC_DIR, 'video'), filename)
 
 
 @app.route('/images/<path:filename>')
 def serve_image_files(filename):
     try:
-        return send_from_directory(IMAGES_DIR, filename)
+        return _send_cached(IMAGES_DIR, filename)
     except Exception:
         return jsonify({"error": "image not found"}), 404
 
 
+def _hash_image_file(args: Tuple[str, str]):
+    # Top-level so ProcessPoolExecutor can pickle it for worker processes
+    art_id, path = args
+    try:
+        with Image.open(path) as img:
+            return art_id, compute_phash_from_image(img)
+    except Exception:
+        return art_id, None
+
+
 @app.route('/precompute', methods=['POST'])
 def precompute():
     if not ARTWORKS:
         return jsonify({"status": "error", "message": "artworks.json missing or empty"}), 400
-    embeddings: Dict[str, int] = {}
-    count = 0
+    # One directory read instead of a stat syscall per artwork
+    try:
+        available = {e.name for e in os.scandir(IMAGES_DIR) if e.is_file()}
+    except OSError:
+        available = set()
+    jobs: List[Tuple[str, str]] = []
     for art_id, meta in ARTWORKS.items():
         filename = meta.get('image')
-        if not filename:
-            continue
-        path = os.path.join(IMAGES_DIR, filename)
-        if not os.path.exists(path):
-            continue
-        try:
-            with Image.open(path) as img:
-                img = img.convert('RGB')
-                ph = compute_phash_from_image(img)
-                embeddings[art_id] = ph
-                count += 1
-        except Exception:
+        if not filename or filename not in available:
             continue
+        jobs.append((art_id, os.path.join(IMAGES_DIR, filename)))
+
+    # Each image is decoded + hashed independently, so fan out across cores
+    embeddings: Dict[str, int] = {}
+    if jobs:
+        with ProcessPoolExecutor() as pool:
+            for art_id, ph in pool.map(_hash_image_file, jobs):
+                if ph is not None:
+                    embeddings[art_id] = ph
     save_embeddings(embeddings)
-    return jsonify({"status": "ok", "count": count})
+    return jsonify({"status": "ok", "count": len(embeddings)})
 
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    pil_img, err = decode_upload_to_image(request)
-    if pil_img is None:
+    img, err = decode_upload_to_image(request)
+    if img is None:
         return jsonify({"error": err}), 400
 
-    # Compute features
+    # Compute features: decode/convert once, share the arrays across
+    # pHash, palette and texture instead of re-converting per feature
     try:
-        ph = compute_phash_from_image(pil_img)
+        rgb_small = np.asarray(preprocess_image_for_matching(img))
+        gray_small = cv2.cvtColor(rgb_small, cv2.COLOR_RGB2GRAY)
+        ph = compute_phash_from_image(gray_small)
     except Exception as e:
         return jsonify({"error": f"Failed to compute pHash: {e}"}), 500
 
     palette = []
     tex_density = 0.0
     try:
-        palette = kmeans_palette(pil_img, k=5)
+        palette = kmeans_palette(rgb_small, k=5)
     except Exception:
         palette = []
     try:
-        tex_density = texture_edge_density(pil_img)
+        tex_density = texture_edge_density(gray_small)
     except Exception:
         tex_density = 0.0
 
-    embeddings = load_embeddings()
-    if not embeddings:
+    ids, phash_arr = _get_phash_index()
+    if not ids:
         return jsonify({"error": "No embeddings found. Run /precompute first."}), 400
-    
-    # Find best match
-    best_id = None
-    best_dist = None
-    all_distances = []
-    for art_id, emb in embeddings.items():
-        d = hamming_distance_int(ph, emb)
-        all_distances.append({"id": art_id, "distance": d})
-        if best_dist is None or d < best_dist:
-            best_dist = d
-            best_id = art_id
-
-    # Sort for debug
-    all_distances.sort(key=lambda x: x["distance"])
+
+    # Find best match: SIMD-backed XOR + popcount passes over the hashes.
+    # Two-phase scan: a near-exact hit in the first block cannot be
+    # beaten meaningfully, so skip the rest of the catalog when found.
+    query = np.uint64(ph)
+    scan_ids = ids
+    dists = _popcount_u64(phash_arr[:SCAN_BLOCK] ^ query)
+    if len(ids) > SCAN_BLOCK:
+        if int(dists.min()) < EARLY_EXIT_DISTANCE:
+            scan_ids = ids[:SCAN_BLOCK]
+        else:
+            dists = np.concatenate(
+                [dists, _popcount_u64(phash_arr[SCAN_BLOCK:] ^ query)])
+    # argmin is branchless, unlike a per-item Python min comparison
+    best_idx = int(dists.argmin())
+    best_id = scan_ids[best_idx]
+    best_dist = int(dists[best_idx])
+
+    # Only the top 3 are reported, so partial-select those instead of
+    # building and sorting a dict per embedding
+    take = min(3, len(scan_ids))
+    idx3 = np.argpartition(dists, take - 1)[:take]
+    idx3 = idx3[np.argsort(dists[idx3])]
+    top_3 = [{"id": scan_ids[i], "distance": int(dists[i])} for i in idx3]
     
     # More lenient threshold: allow up to 40 Hamming distance (was 32)
     # This accounts for camera variations, lighting, angle differences
@@ -310,9 +594,10 @@ def analyze():
     confidence = max(0.0, min(1.0, 1.0 - (best_dist / 64.0)))
     matched = best_dist <= MAX_DISTANCE
     
-    # Debug logging
-    print(f"[ANALYZE] Best match: {best_id} (distance={best_dist}, confidence={confidence:.2f}, matched={matched})")
-    print(f"[ANALYZE] Top 3 distances: {all_distances[:3]}")
+    # Lazy %s formatting: no string construction unless DEBUG is enabled
+    logger.debug("Best match: %s (distance=%d, confidence=%.2f, matched=%s)",
+                 best_id, best_dist, confidence, matched)
+    logger.debug("Top 3 distances: %s", top_3)
     
     metadata = ARTWORKS.get(best_id) if matched else None
 
@@ -327,7 +612,7 @@ def analyze():
             "best_match": best_id,
             "best_distance": int(best_dist),
             "threshold": MAX_DISTANCE,
-            "top_3": all_distances[:3]
+            "top_3": top_3
         }
     }
     if metadata is not None:
@@ -363,13 +648,7 @@ def analytics_single():
     event.setdefault('id', str(uuid.uuid4()))
     if 'timestamp' not in event:
         event['timestamp'] = datetime.utcnow().isoformat() + 'Z'
-    try:
-        with open(ANALYTICS_LOG, 'r', encoding='utf-8') as f:
-            arr = json.load(f)
-    except Exception:
-        arr = []
-    arr.append(event)
-    safe_write_json(ANALYTICS_LOG, arr)
+    _append_analytics_events([event])
     return jsonify({"status": "ok"})
 
 
@@ -383,13 +662,7 @@ def analytics_batch():
         e.setdefault('id', str(uuid.uuid4()))
         if 'timestamp' not in e:
             e['timestamp'] = datetime.utcnow().isoformat() + 'Z'
-    try:
-        with open(ANALYTICS_LOG, 'r', encoding='utf-8') as f:
-            arr = json.load(f)
-    except Exception:
-        arr = []
-    arr.extend(events)
-    safe_write_json(ANALYTICS_LOG, arr)
+    _append_analytics_events(events)
     return jsonify({"status": "ok", "received": len(events)})
 
 
@@ -397,11 +670,20 @@ def analytics_batch():
 
 # Simple admin auth (for MVP - use env var in production)
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
-ADMIN_TOKENS = {}  # In-memory token store (use Redis in production)
+ADMIN_TOKENS = {}  # In-memory token -> created_at store (use Redis in production)
+ADMIN_TOKEN_TTL = timedelta(hours=8)
+
+def _evict_expired_tokens(now: datetime) -> None:
+    # Lazy TTL eviction so the token store stays bounded
+    expired = [t for t, created in ADMIN_TOKENS.items()
+               if now - created > ADMIN_TOKEN_TTL]
+    for t in expired:
+        del ADMIN_TOKENS[t]
 
 def require_admin(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        _evict_expired_tokens(datetime.utcnow())
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
         if not token or token not in ADMIN_TOKENS:
             return jsonify({"error": "Unauthorized"}), 401
@@ -419,8 +701,12 @@ def serve_admin():
 def admin_login():
     data = request.get_json(silent=True) or {}
     password = data.get('password', '')
-    if password == ADMIN_PASSWORD:
+    # compare_digest raises on non-str or non-ASCII input, so reject
+    # non-strings and compare as bytes
+    if isinstance(password, str) and hmac.compare_digest(
+            password.encode('utf-8'), ADMIN_PASSWORD.encode('utf-8')):
         token = secrets.token_urlsafe(32)
+        _evict_expired_tokens(datetime.utcnow())
         ADMIN_TOKENS[token] = datetime.utcnow()
         return jsonify({"token": token, "status": "ok"})
     return jsonify({"error": "Invalid password"}), 401
@@ -536,6 +822,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--debug', action='store_true', help='Enable Flask debug mode')
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=bool(args.debug))
 